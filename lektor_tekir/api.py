@@ -8,6 +8,7 @@ from __future__ import annotations
 import json
 import subprocess
 import sys
+import tarfile
 from http import HTTPStatus
 from pathlib import Path
 from typing import Iterable
@@ -16,14 +17,15 @@ from uuid import uuid4
 from flask import Blueprint, Response, g, render_template, request, url_for
 from flask_babel import format_datetime
 from flask_babel import gettext as _
+from jinja2 import TemplateError, TemplateNotFound
 from lektor.builder import Builder
 from lektor.constants import PRIMARY_ALT
 from lektor.db import Pad, Query, Record, TreeItem
 from lektor.environment.config import ServerInfo
-from lektor.publisher import publish
 from slugify import slugify
 
-from . import utils
+from . import archives, autobuild, invalidation, metadata, publisher, \
+    references, usage, utils, validation, writer
 
 
 FILE_MANAGERS: dict[str, str] = {
@@ -43,6 +45,13 @@ def error_response(errors: list[str]) -> Response:
     return response
 
 
+def content_changed(path: str) -> None:
+    utils.refresh_tree_index(g.admin_context.pad.env, path)
+    references.refresh_references(g.admin_context.pad.env, path)
+    invalidation.publish(path)
+    autobuild.mark_dirty()
+
+
 def open_folder() -> Response:
     file_manager = FILE_MANAGERS.get(sys.platform)
     if file_manager is None:
@@ -72,7 +81,9 @@ def open_folder() -> Response:
 def site_summary() -> str:
     root: Record = g.admin_context.pad.root
     page_count = utils.get_page_count(root)
-    return render_template("partials/site-summary.html", page_count=page_count)
+    write_stats = writer.get_writer().get_stats()
+    return render_template("partials/site-summary.html", page_count=page_count,
+                           write_stats=write_stats)
 
 
 def site_output() -> str:
@@ -87,14 +98,16 @@ def site_output() -> str:
 
 def clean_build() -> str:
     builder: Builder = g.admin_context.info.get_builder()
-    builder.prune(all=True)
+    with autobuild.build_lock(builder.env):
+        builder.prune(all=True)
     builder.touch_site_config()
     return _("No output")
 
 
 def build() -> str | Response:
     builder: Builder = g.admin_context.info.get_builder()
-    n_failures = builder.build_all()
+    with autobuild.build_lock(builder.env):
+        n_failures = builder.build_all()
     if n_failures > 0:
         errors = []
         for failure in Path(builder.failure_controller.path).glob("*.json"):
@@ -108,6 +121,25 @@ def build() -> str | Response:
     return output_time
 
 
+def auto_build_status() -> str:
+    auto_builder = autobuild.get_auto_builder()
+    if auto_builder is None:
+        return ""
+    build_time = format_datetime(auto_builder.last_build, format="long") \
+        if auto_builder.last_build is not None else _("No output")
+    return render_template("partials/auto-build-status.html",
+                           auto_builder=auto_builder, build_time=build_time)
+
+
+def output_usage() -> str:
+    path = request.args.get("path", "/")
+    builder: Builder = g.admin_context.info.get_builder()
+    summary = usage.summarize_usage(usage.get_usage(builder), path)
+    return render_template("partials/output-usage.html", path=path,
+                           sections=summary["sections"],
+                           file_types=summary["file_types"])
+
+
 def publish_info() -> Response:
     servers: list[ServerInfo] = g.admin_context.pad.config.get_servers()
     markup = render_template("partials/publish-dialog.html", servers=servers)
@@ -125,10 +157,8 @@ def publish_build() -> str | Response:
     pad: Pad = g.admin_context.pad
     server_info: ServerInfo = pad.config.get_server(server_id)
     builder: Builder = g.admin_context.info.get_builder()
-    event_iter: Iterable[str] = publish(pad.env,
-                                        server_info.target,
-                                        builder.destination_path,
-                                        server_info=server_info)
+    event_iter: Iterable[str] = publisher.publish_site(
+        pad.env, server_info, builder.destination_path)
     event_lines: list[str] = []
     for line in event_iter:
         event_lines.append(line)
@@ -136,13 +166,22 @@ def publish_build() -> str | Response:
     return content
 
 
+def validate_site() -> str:
+    pad: Pad = g.admin_context.pad
+    errors = validation.validate_site(pad.env)
+    return render_template("partials/validation-report.html", errors=errors,
+                           messages=validation.MESSAGES)
+
+
 def content_summary() -> str | Response:
     record, status = utils.get_record(g.admin_context.pad, request.args)
     if record is None:
         return Response("", status=status)
     template = "content-summary.html" if not record.is_attachment else \
         "attachment-summary.html"
-    return render_template(f"partials/{template}", record=record)
+    referrers = references.get_referrers(record.pad.env, [record.path])
+    return render_template(f"partials/{template}", record=record,
+                           referrers=referrers)
 
 
 def content_translations() -> str | Response:
@@ -174,8 +213,15 @@ def content_attachments() -> str | Response:
                                         .include_undiscoverable(True)
     if children.get_order_by() is None:
         children = children.order_by("_slug")
+    attachments: list[Record] = list(children)
+    infos = metadata.get_attachment_infos(attachments)
+    sort_key = request.args.get("sort")
+    if sort_key in metadata.SORT_KEYS:
+        attachments.sort(key=lambda a: metadata.sort_value(infos[a.path],
+                                                           sort_key))
     return render_template("partials/content-attachments.html", record=record,
-                           attachments=children)
+                           attachments=attachments, infos=infos,
+                           sort_key=sort_key)
 
 
 def delete_confirm() -> Response:
@@ -187,8 +233,13 @@ def delete_confirm() -> Response:
     pad: Pad = g.admin_context.pad
     records: list[Record] = [pad.get(i, alt=PRIMARY_ALT) for i in items]
     fs_paths = utils.get_record_paths(records, root=pad.root)
+    targets = references.get_target_paths(fs_paths)
+    # links between the deleted items themselves don't matter
+    referrers = [r for r in references.get_referrers(pad.env, targets)
+                 if r[0] not in targets]
     markup = render_template("partials/delete-dialog.html",
-                             items=sorted(fs_paths), form_id=form_id)
+                             items=sorted(fs_paths), referrers=referrers,
+                             form_id=form_id)
     response = Response(markup)
     trigger = '{"showModal": {"modal": "#delete-dialog"}}'
     response.headers["HX-Trigger-After-Swap"] = trigger
@@ -228,6 +279,8 @@ def delete_content() -> Response:
     records: list[Record] = [pad.get(i, alt=PRIMARY_ALT) for i in items]
     for record in records:
         utils.delete_record(record)
+        metadata.remove_attachment_info(pad, record.path)
+        content_changed(record.path)
     response = Response("")
     detail = '{"form": "%(form)s", "modal": "%(modal)s"}' % {
         "form": f"#{form_id}",
@@ -247,6 +300,7 @@ def delete_translation() -> str | Response:
     pad: Pad = g.admin_context.pad
     record: Record = pad.get(path, alt=alt)
     Path(record.source_filename).unlink()
+    content_changed(path)
     primary: Record = pad.get(path, alt=PRIMARY_ALT)
     node: TreeItem = g.admin_context.tree.get(path)
     return render_template("partials/content-translations.html",
@@ -259,7 +313,21 @@ def slug_from_title() -> Response:
         return Response("", status=HTTPStatus.UNPROCESSABLE_ENTITY)
 
     slug = slugify(title)
-    response = Response(slug)
+    message = ""
+    if "path" in request.args:
+        pad: Pad = g.admin_context.pad
+        parent, status = utils.get_record(pad, request.args)
+        if parent is None:
+            return Response("", status=status)
+        if parent.is_attachment:
+            return Response("", status=HTTPStatus.UNPROCESSABLE_ENTITY)
+        slugs = utils.get_child_slugs(pad, parent.path)
+        free_slug = utils.get_free_slug(slugs, slug)
+        if free_slug != slug:
+            message = _("This name is already taken, suggested:") + \
+                f" '{free_slug}'"
+            slug = free_slug
+    response = Response(message)
     detail = '{"target": "%(sel)s", "attr": "%(att)s", "value": "%(val)s"}' % {
         "sel": "#field-_slug",
         "att": "value",
@@ -321,6 +389,7 @@ def add_subpage() -> Response:
     except FileExistsError:
         errors = [_("A content item with this name already exists.")]
         return error_response(errors)
+    content_changed(path)
 
     response = Response("")
     record_url = url_for("tekir_admin.edit_content", path=path)
@@ -344,6 +413,7 @@ def add_translation() -> Response:
     except FileExistsError:
         errors = [_("A translation for this language already exists.")]
         return error_response(errors)
+    content_changed(record.path)
 
     response = Response("")
     record_url = url_for("tekir_admin.edit_content", path=record.path, alt=alt)
@@ -386,6 +456,8 @@ def add_attachment() -> Response:
     except FileExistsError:
         errors = [_("An attachment with this name already exists.")]
         return error_response(errors)
+    metadata.update_attachment_info(pad, path)
+    content_changed(path)
 
     response = Response()
     record_url = url_for("tekir_admin.contents", path=path, alt=PRIMARY_ALT)
@@ -406,6 +478,8 @@ def replace_attachment() -> Response:
 
     source_path = Path(pad.db.to_fs_path(record.path))
     uploaded.save(source_path)
+    metadata.update_attachment_info(pad, record.path)
+    content_changed(record.path)
 
     response = Response("")
     record_url = url_for("tekir_admin.contents", path=record.path,
@@ -414,6 +488,50 @@ def replace_attachment() -> Response:
     return response
 
 
+def export_content() -> Response:
+    record, status = utils.get_record(g.admin_context.pad, request.args,
+                                      alt=PRIMARY_ALT)
+    if record is None:
+        return Response("", status=status)
+    if (record.path == "/") or record.is_attachment:
+        return Response("", status=HTTPStatus.UNPROCESSABLE_ENTITY)
+
+    filename = f"{record['_slug'] or record['_id']}.tar"
+    # the archive is streamed after the request, when the pad is gone
+    record_dir = Path(record.source_filename).parent
+    response = Response(archives.iter_archive(record_dir),
+                        mimetype="application/x-tar")
+    response.headers["Content-Disposition"] = \
+        f'attachment; filename="{filename}"'
+    return response
+
+
+def import_content() -> Response:
+    pad: Pad = g.admin_context.pad
+    parent, status = utils.get_record(pad, request.args, alt=PRIMARY_ALT)
+    if parent is None:
+        return Response("", status=status)
+    if parent.is_attachment:
+        return Response("", status=HTTPStatus.UNPROCESSABLE_ENTITY)
+
+    try:
+        path = archives.extract_archive(pad=pad, parent=parent,
+                                        stream=request.stream)
+    except FileExistsError:
+        errors = [_("A content item with this name already exists.")]
+        return error_response(errors)
+    except (ValueError, tarfile.TarError, OSError) as e:
+        errors = [str(e)]
+        return error_response(errors)
+    content_changed(path)
+
+    response = Response("")
+    record_url = url_for("tekir_admin.contents", path=parent.path,
+                         alt=PRIMARY_ALT)
+    response.headers["HX-Redirect"] = record_url
+    return response
+
+
 def save_content() -> Response:
     record, status = utils.get_record(g.admin_context.pad, request.args)
     if record is None:
@@ -423,8 +541,9 @@ def save_content() -> Response:
     if source == source_path.read_text():
         message = _("No changes.")
     else:
-        source_path.write_text(source)
+        writer.write_source(source_path, source)
         message = _("Content saved.")
+        content_changed(record.path)
 
     markup = render_template("partials/save-dialog.html", message=message,
                              record=record)
@@ -456,6 +575,24 @@ def check_changes() -> Response:
     return response
 
 
+def preview_content() -> str | Response:
+    record, status = utils.get_record(g.admin_context.pad, request.args)
+    if record is None:
+        return Response("", status=status)
+    try:
+        source = utils.get_source(record, request.form)
+        return utils.render_preview(record, source)
+    except RuntimeError:
+        errors = [_("All fields of a flow block must be of the same type.")]
+    except TemplateNotFound as e:
+        errors = [_("Template not found:") + f" '{e.name}'"]
+    except TemplateError as e:
+        errors = [_("Template error:") + f" {e.message}"]
+    # preview opens in a new tab, not through htmx
+    markup = render_template("tekir_preview_error.html", errors=errors)
+    return Response(markup, status=HTTPStatus.UNPROCESSABLE_ENTITY)
+
+
 def new_flowblock() -> str | Response:
     field_name = request.args.get("field_name")
     flow_type = request.args.get("flow_type")
@@ -512,9 +649,12 @@ def make_blueprint():
     bp.add_url_rule("/site-output", view_func=site_output)
     bp.add_url_rule("/clean-build", view_func=clean_build)
     bp.add_url_rule("/build", view_func=build)
+    bp.add_url_rule("/auto-build-status", view_func=auto_build_status)
+    bp.add_url_rule("/output-usage", view_func=output_usage)
     bp.add_url_rule("/publish-info", view_func=publish_info)
     bp.add_url_rule("/publish-build", view_func=publish_build,
                     methods=["POST"])
+    bp.add_url_rule("/validate-site", view_func=validate_site)
 
     bp.add_url_rule("/content-summary", view_func=content_summary)
     bp.add_url_rule("/content-translations", view_func=content_translations)
@@ -539,10 +679,16 @@ def make_blueprint():
     bp.add_url_rule("/add-attachment", view_func=add_attachment,
                     methods=["POST"])
 
+    bp.add_url_rule("/export-content", view_func=export_content)
+    bp.add_url_rule("/import-content", view_func=import_content,
+                    methods=["POST"])
+
     bp.add_url_rule("/save-content", view_func=save_content,
                     methods=["POST"])
     bp.add_url_rule("/check-changes", view_func=check_changes,
                     methods=["POST"])
+    bp.add_url_rule("/preview-content", view_func=preview_content,
+                    methods=["POST"])
     bp.add_url_rule("/replace-attachment", view_func=replace_attachment,
                     methods=["POST"])
     bp.add_url_rule("/new-flowblock", view_func=new_flowblock)
@@ -0,0 +1,126 @@
+# Copyright (C) 2023 H. Turgut Uyar <uyar@tekir.org>
+#
+# lektor-tekir is released under the BSD license.
+# Read the included LICENSE.txt file for details.
+
+from __future__ import annotations
+
+import os
+import shutil
+import tarfile
+from pathlib import Path, PurePosixPath
+from typing import IO, Iterator
+
+from lektor.db import Pad, Record
+
+from . import utils
+
+
+CHUNK_SIZE = 64 * 1024
+
+NUL = b"\0"
+
+
+def make_tarinfo(fs_path: Path, arcname: str) -> tarfile.TarInfo:
+    stat = fs_path.stat()
+    info = tarfile.TarInfo(arcname)
+    info.mtime = int(stat.st_mtime)
+    if fs_path.is_dir():
+        info.type = tarfile.DIRTYPE
+        info.mode = 0o755
+    else:
+        info.size = stat.st_size
+        info.mode = 0o644
+    return info
+
+
+def iter_archive(record_dir: Path) -> Iterator[bytes]:
+    # tar members are produced one chunk at a time to keep memory constant
+    base_dir = record_dir.parent
+    offset = 0
+    for dir_path, dir_names, file_names in os.walk(record_dir):
+        dir_names.sort()
+        fs_paths = [Path(dir_path)] + \
+            [Path(dir_path, f) for f in sorted(file_names)]
+        for fs_path in fs_paths:
+            arcname = fs_path.relative_to(base_dir).as_posix()
+            info = make_tarinfo(fs_path, arcname)
+            header = info.tobuf(tarfile.PAX_FORMAT, "utf-8",
+                                "surrogateescape")
+            offset += len(header)
+            yield header
+            if not info.isfile():
+                continue
+            with fs_path.open("rb") as f:
+                while True:
+                    chunk = f.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    offset += len(chunk)
+                    yield chunk
+            remainder = info.size % tarfile.BLOCKSIZE
+            if remainder > 0:
+                padding = NUL * (tarfile.BLOCKSIZE - remainder)
+                offset += len(padding)
+                yield padding
+    end = NUL * (2 * tarfile.BLOCKSIZE)
+    offset += len(end)
+    yield end
+    remainder = offset % tarfile.RECORDSIZE
+    if remainder > 0:
+        yield NUL * (tarfile.RECORDSIZE - remainder)
+
+
+def get_member_path(member: tarfile.TarInfo) -> PurePosixPath:
+    member_path = PurePosixPath(member.name)
+    if member_path.is_absolute() or (".." in member_path.parts) or \
+            (len(member_path.parts) == 0):
+        raise ValueError(f"Unsafe path in archive: '{member.name}'")
+    if not (member.isdir() or member.isfile()):
+        raise ValueError(f"Unsupported item in archive: '{member.name}'")
+    return member_path
+
+
+def remove_item(fs_path: Path) -> None:
+    if fs_path.is_dir():
+        shutil.rmtree(fs_path, ignore_errors=True)
+    elif fs_path.exists():
+        fs_path.unlink()
+
+
+def extract_archive(*, pad: Pad, parent: Record, stream: IO[bytes]) -> str:
+    # the archive must contain a single content item, as exported
+    parent_dir = Path(parent.source_filename).parent
+    slug: str | None = None
+    try:
+        with tarfile.open(fileobj=stream, mode="r|*") as archive:
+            for member in archive:
+                member_path = get_member_path(member)
+                if (len(member_path.parts) == 1) and not member.isdir():
+                    raise ValueError("Archive item is not a folder")
+                if slug is None:
+                    if (parent_dir / member_path.parts[0]).exists():
+                        raise FileExistsError(
+                            f"Duplicate slug: '{member_path.parts[0]}'")
+                    slug = member_path.parts[0]
+                elif member_path.parts[0] != slug:
+                    raise ValueError("Archive contains more than one item")
+                fs_path = parent_dir.joinpath(*member_path.parts)
+                if member.isdir():
+                    fs_path.mkdir(parents=True, exist_ok=True)
+                    continue
+                fs_path.parent.mkdir(parents=True, exist_ok=True)
+                source = archive.extractfile(member)
+                if source is None:
+                    continue
+                with fs_path.open("wb") as f:
+                    shutil.copyfileobj(source, f, CHUNK_SIZE)
+    except BaseException:
+        # don't leave a partially extracted item behind
+        if slug is not None:
+            remove_item(parent_dir / slug)
+        raise
+    if slug is None:
+        raise ValueError("Archive is empty")
+    utils.get_child_slugs(pad, parent.path).add(slug)
+    return f"{parent.path.rstrip('/')}/{slug}"
@@ -0,0 +1,130 @@
+# Copyright (C) 2023 H. Turgut Uyar <uyar@tekir.org>
+#
+# lektor-tekir is released under the BSD license.
+# Read the included LICENSE.txt file for details.
+
+from __future__ import annotations
+
+import os
+import sys
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from datetime import datetime
+from threading import Condition, Lock, Thread
+from typing import Iterator
+
+from flask import current_app
+from lektor.admin.webui import LektorInfo
+from lektor.environment import Environment
+
+from . import utils
+
+
+if sys.platform != "win32":
+    import fcntl
+
+
+LOCK_FILE = "build.lock"
+
+# shared by the auto-builder and manual builds so that they never overlap,
+# the lock file does the same for the other worker processes
+BUILD_LOCK = Lock()
+
+
+@contextmanager
+def build_lock(env: Environment) -> Iterator[None]:
+    with BUILD_LOCK:
+        if sys.platform == "win32":
+            yield
+            return
+        with open(utils.get_cache_path(env) / LOCK_FILE, "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class AutoBuilder:
+    def __init__(self, info: LektorInfo, *, delay: float) -> None:
+        self.info = info
+        self.delay = delay
+        self.state = "idle"
+        self.last_change: float | None = None
+        self.last_build: datetime | None = None
+        self.n_failures = 0
+        self.error: str | None = None
+        self.condition = Condition()
+        self.pid: int | None = None
+
+    def start(self) -> None:
+        # threads don't survive the fork into worker processes,
+        # so every process starts its own on its first change
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.condition = Condition()
+            self.state = "idle"
+            self.last_change = None
+            thread = Thread(target=self.run, name="tekir-auto-build",
+                            daemon=True)
+            thread.start()
+
+    def mark_dirty(self) -> None:
+        self.start()
+        with self.condition:
+            self.last_change = time.monotonic()
+            if self.state == "idle":
+                self.state = "pending"
+            self.condition.notify()
+
+    def wait_until_quiet(self) -> None:
+        with self.condition:
+            while self.last_change is None:
+                self.condition.wait()
+            while True:
+                remaining = self.last_change + self.delay - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(timeout=remaining)
+            self.last_change = None
+            self.state = "building"
+
+    def run(self) -> None:
+        while True:
+            self.wait_until_quiet()
+            error: str | None = None
+            n_failures = 0
+            try:
+                builder = self.info.get_builder()
+                with build_lock(self.info.env):
+                    n_failures = builder.build_all()
+            except Exception as e:
+                # keep the thread alive for the next change
+                traceback.print_exc()
+                error = str(e) or e.__class__.__name__
+            with self.condition:
+                self.n_failures = n_failures
+                self.error = error
+                if error is None:
+                    self.last_build = datetime.now()
+                self.state = "idle" if self.last_change is None else "pending"
+
+
+def is_dev_server_building() -> bool:
+    # the dev server of "lektor serve" already builds after every change
+    # (imported here so that the devserver picks up the patched WebAdmin)
+    from lektor.devserver import BackgroundBuilder
+    return any(isinstance(t, BackgroundBuilder) and t.is_alive()
+               for t in threading.enumerate())
+
+
+def get_auto_builder() -> AutoBuilder | None:
+    return current_app.extensions.get("tekir_auto_build")
+
+
+def mark_dirty() -> None:
+    auto_builder = get_auto_builder()
+    if auto_builder is not None:
+        auto_builder.mark_dirty()
@@ -3,17 +3,25 @@
 # lektor-tekir is released under the BSD license.
 # Read the included LICENSE.txt file for details.
 
+import os
 from pathlib import Path
 
+import click
 from flask import g
 from flask_babel import Babel
 from lektor import admin
 from lektor.admin.modules import serve
 from lektor.admin.webui import WebUI
 from lektor.cli import cli
+from lektor.cli_utils import pass_context
 
-from lektor_tekir import dash
+from lektor_tekir import dash, metadata, validation
+from lektor_tekir.autobuild import AutoBuilder, is_dev_server_building
+from lektor_tekir.invalidation import InvalidationChannel
+from lektor_tekir.publisher import register_publishers
+from lektor_tekir.usage import register_usage_tracking
 from lektor_tekir.utils import i18n_name
+from lektor_tekir.writer import FSYNC_MODES, ContentWriter
 
 
 class TekirAdminUI(WebUI):
@@ -30,6 +38,29 @@ class TekirAdminUI(WebUI):
                       default_translation_directories=str(locale_dir))
         self.jinja_env.globals["i18n_name"] = i18n_name
 
+        register_publishers(self.lektor_info.env)
+        register_usage_tracking(self.lektor_info.env)
+
+        fsync = os.environ.get("TEKIR_FSYNC", "none")
+        if fsync not in FSYNC_MODES:
+            choices = ", ".join(sorted(FSYNC_MODES))
+            raise click.ClickException(f"Invalid TEKIR_FSYNC value: '{fsync}'"
+                                       f" (choose from {choices})")
+        self.extensions["tekir_writer"] = ContentWriter(fsync=fsync)
+
+        channel = InvalidationChannel(self.lektor_info.env)
+        self.extensions["tekir_invalidation"] = channel
+        self.before_request(channel.poll)
+
+        auto_build_delay = os.environ.get("TEKIR_AUTO_BUILD_DELAY")
+        if (auto_build_delay is not None) and is_dev_server_building():
+            click.echo("TEKIR_AUTO_BUILD_DELAY is ignored, the development"
+                       " server already builds after every change.", err=True)
+        elif auto_build_delay is not None:
+            auto_builder = AutoBuilder(self.lektor_info,
+                                       delay=float(auto_build_delay))
+            self.extensions["tekir_auto_build"] = auto_builder
+
 
 rewrite_html_original = serve.rewrite_html_for_editing
 
@@ -39,6 +70,35 @@ def rewrite_html_tekir(fp, edit_url):
     return rewrite_html_original(fp, tekir_url)
 
 
+@click.command("tekir-metadata")
+@click.option("-j", "--jobs", type=int, default=None,
+              help="Number of worker processes.")
+@pass_context
+def backfill_metadata(ctx, jobs):
+    """Update the attachment metadata index for all attachments."""
+    env = ctx.get_env()
+    count = metadata.backfill(env, jobs=jobs)
+    click.echo(f"Updated metadata for {count} attachments.")
+
+
+@click.command("tekir-validate")
+@click.option("-j", "--jobs", type=int, default=None,
+              help="Number of worker processes.")
+@pass_context
+def validate_contents(ctx, jobs):
+    """Check all content files against their data models."""
+    ctx.load_plugins()
+    env = ctx.get_env()
+    errors = validation.validate_site(env, jobs=jobs)
+    for path, alt, field, message, detail in errors:
+        text = validation.MESSAGES[message]
+        if detail != "":
+            text = f"{text}: {detail}"
+        click.echo(f"{path} ({alt}) {field}: {text}")
+    if len(errors) > 0:
+        raise SystemExit(1)
+
+
 def main():
     # XXX: remove when Turkish translation is guaranteed to be installed
     import lektor
@@ -49,4 +109,6 @@ def main():
 
     admin.WebAdmin = TekirAdminUI
     serve.rewrite_html_for_editing = rewrite_html_tekir
+    cli.add_command(backfill_metadata)
+    cli.add_command(validate_contents)
     cli()
@@ -10,7 +10,7 @@ from pathlib import Path
 from flask import Blueprint, Response, current_app, g, render_template, request
 from flask_babel import Babel
 
-from . import api, utils
+from . import api, metadata, utils
 
 
 def preferences() -> str:
@@ -28,9 +28,12 @@ def contents() -> str | Response:
     if record is None:
         return Response("", status=status)
     ancestors = utils.get_ancestors(record)
-    template = "tekir_contents.html" if not record.is_attachment else \
-        "tekir_attachment.html"
-    return render_template(template, record=record, ancestors=ancestors)
+    if not record.is_attachment:
+        return render_template("tekir_contents.html", record=record,
+                               ancestors=ancestors)
+    info = metadata.get_attachment_infos([record])[record.path]
+    return render_template("tekir_attachment.html", record=record,
+                           ancestors=ancestors, info=info)
 
 
 def edit_content() -> str | Response:
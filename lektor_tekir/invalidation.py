@@ -0,0 +1,99 @@
+# Copyright (C) 2023 H. Turgut Uyar <uyar@tekir.org>
+#
+# lektor-tekir is released under the BSD license.
+# Read the included LICENSE.txt file for details.
+
+from __future__ import annotations
+
+import os
+import sqlite3
+from pathlib import Path
+from threading import Lock
+from typing import Callable, List
+
+from flask import current_app
+from lektor.environment import Environment
+
+from . import metadata, references, utils
+
+
+# called with the environment and the record path that has changed
+Handler = Callable[[Environment, str], None]
+
+HANDLERS: List[Handler] = [
+    utils.forget_child_slugs,
+    utils.refresh_tree_index,
+    metadata.forget_attachment_info,
+    references.refresh_references,
+]
+
+CHANNEL_FILE = "invalidation.sqlite"
+
+# number of events to keep for processes that have fallen behind
+KEEP_EVENTS = 10000
+
+
+def invalidate(env: Environment, path: str) -> None:
+    for handler in HANDLERS:
+        handler(env, path)
+
+
+class InvalidationChannel:
+    def __init__(self, env: Environment) -> None:
+        self.env = env
+        self.db_path: Path = utils.get_cache_path(env) / CHANNEL_FILE
+        self.lock = Lock()
+        self.pid: int | None = None
+        self.connection: sqlite3.Connection | None = None
+        self.last_id = 0
+
+    def connect(self) -> sqlite3.Connection:
+        # connections can't be shared with forked worker processes
+        if (self.connection is None) or (self.pid != os.getpid()):
+            self.pid = os.getpid()
+            connection = sqlite3.connect(self.db_path, timeout=10,
+                                         isolation_level=None,
+                                         check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS events"
+                " (id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " pid INTEGER, path TEXT)")
+            row = connection.execute("SELECT MAX(id) FROM events").fetchone()
+            self.last_id = row[0] or 0
+            self.connection = connection
+        return self.connection
+
+    def publish(self, path: str) -> None:
+        with self.lock:
+            connection = self.connect()
+            cursor = connection.execute(
+                "INSERT INTO events (pid, path) VALUES (?, ?)",
+                (self.pid, path))
+            event_id = cursor.lastrowid
+            if (event_id is not None) and (event_id % 1000 == 0):
+                connection.execute("DELETE FROM events WHERE id <= ?",
+                                   (event_id - KEEP_EVENTS,))
+
+    def poll(self) -> None:
+        with self.lock:
+            connection = self.connect()
+            rows = connection.execute(
+                "SELECT id, pid, path FROM events WHERE id > ? ORDER BY id",
+                (self.last_id,)).fetchall()
+            if len(rows) == 0:
+                return
+            self.last_id = rows[-1][0]
+        for _, pid, path in rows:
+            if pid != self.pid:
+                invalidate(self.env, path)
+
+
+def get_channel() -> InvalidationChannel | None:
+    return current_app.extensions.get("tekir_invalidation")
+
+
+def publish(path: str) -> None:
+    channel = get_channel()
+    if channel is not None:
+        channel.publish(path)
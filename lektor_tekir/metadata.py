@@ -0,0 +1,188 @@
+# Copyright (C) 2023 H. Turgut Uyar <uyar@tekir.org>
+#
+# lektor-tekir is released under the BSD license.
+# Read the included LICENSE.txt file for details.
+
+from __future__ import annotations
+
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from threading import Lock
+from typing import Any, Dict
+
+from lektor.db import Pad, Record
+from lektor.environment import Environment
+from lektor.imagetools import get_image_info, read_exif
+from lektor.videotools import get_video_info
+
+from . import utils
+
+
+# size, mtime, format, width, height, created, duration
+AttachmentInfo = Dict[str, Any]
+
+VIDEO_SUFFIXES: set[str] = {".avi", ".mkv", ".mov", ".mp4", ".mpeg", ".mpg",
+                            ".ogv", ".webm", ".wmv"}
+
+SORT_KEYS: list[str] = ["size", "created", "duration"]
+
+INDEX_FILE = "attachments.json"
+
+# project id -> record path -> attachment info
+INDEXES: dict[str, dict[str, AttachmentInfo]] = {}
+INDEX_LOCK = Lock()
+
+
+def extract_metadata(fs_path: str) -> AttachmentInfo:
+    stat = os.stat(fs_path)
+    info: AttachmentInfo = {
+        "size": stat.st_size,
+        "mtime": stat.st_mtime_ns,
+        "format": None,
+        "width": None,
+        "height": None,
+        "created": None,
+        "duration": None,
+    }
+    # Lektor raises plain exceptions for malformed files,
+    # keep the size and time for those
+    try:
+        with open(fs_path, "rb") as f:
+            image_format, width, height = get_image_info(f)
+            if image_format != "unknown":
+                info.update(format=image_format, width=width, height=height)
+            if image_format == "jpeg":
+                f.seek(0)
+                created = read_exif(f).created_at
+                if created is not None:
+                    info["created"] = created.isoformat()
+    except Exception:
+        info.update(format=None, width=None, height=None, created=None)
+    if Path(fs_path).suffix.lower() in VIDEO_SUFFIXES:
+        try:
+            video_info = get_video_info(fs_path)
+        except Exception:
+            pass
+        else:
+            info.update(format="video", width=video_info["width"],
+                        height=video_info["height"])
+            if video_info["duration"] is not None:
+                info["duration"] = video_info["duration"].total_seconds()
+    return info
+
+
+def sort_value(info: AttachmentInfo, key: str) -> tuple[bool, Any]:
+    value = info.get(key)
+    return (value is None, value if value is not None else 0)
+
+
+def get_index(env: Environment) -> dict[str, AttachmentInfo]:
+    index = INDEXES.get(env.project.id)
+    if index is None:
+        index_path = utils.get_cache_path(env) / INDEX_FILE
+        index = json.loads(index_path.read_text()) \
+            if index_path.exists() else {}
+        INDEXES[env.project.id] = index
+    return index
+
+
+def save_index(env: Environment) -> None:
+    with INDEX_LOCK:
+        data = json.dumps(get_index(env))
+    index_path = utils.get_cache_path(env) / INDEX_FILE
+    tmp_path = index_path.with_suffix(".tmp")
+    tmp_path.write_text(data)
+    tmp_path.replace(index_path)
+
+
+def set_attachment_info(pad: Pad, path: str) -> AttachmentInfo:
+    info = extract_metadata(pad.db.to_fs_path(path))
+    with INDEX_LOCK:
+        get_index(pad.env)[path] = info
+    return info
+
+
+def update_attachment_info(pad: Pad, path: str) -> AttachmentInfo:
+    info = set_attachment_info(pad, path)
+    save_index(pad.env)
+    return info
+
+
+def remove_attachment_info(pad: Pad, path: str) -> None:
+    # also the attachments of the pages below the path
+    prefix = path.rstrip("/") + "/"
+    with INDEX_LOCK:
+        index = get_index(pad.env)
+        for key in [p for p in index if (p == path) or p.startswith(prefix)]:
+            del index[key]
+    save_index(pad.env)
+
+
+def forget_attachment_info(env: Environment, path: str) -> None:
+    # the index will be reloaded from the file saved by the other process
+    INDEXES.pop(env.project.id, None)
+
+
+def get_attachment_infos(records: list[Record]) -> dict[str, AttachmentInfo]:
+    infos: dict[str, AttachmentInfo] = {}
+    changed: Environment | None = None
+    for record in records:
+        pad: Pad = record.pad
+        info = get_index(pad.env).get(record.path)
+        fs_path = pad.db.to_fs_path(record.path)
+        if (info is None) or (info["mtime"] != os.stat(fs_path).st_mtime_ns):
+            info = set_attachment_info(pad, record.path)
+            changed = pad.env
+        infos[record.path] = info
+    if changed is not None:
+        save_index(changed)
+    return infos
+
+
+def get_stale_attachments(env: Environment) -> dict[str, str]:
+    content_path = Path(env.root_path) / "content"
+    index = get_index(env)
+    stale: dict[str, str] = {}
+    for dir_path, dir_names, file_names in os.walk(content_path):
+        dir_names[:] = [d for d in dir_names
+                        if not env.is_uninteresting_source_name(d)]
+        for file_name in file_names:
+            if file_name.endswith(".lr") or \
+                    env.is_uninteresting_source_name(file_name):
+                continue
+            fs_path = Path(dir_path, file_name)
+            path = "/" + fs_path.relative_to(content_path).as_posix()
+            info = index.get(path)
+            if (info is None) or \
+                    (info["mtime"] != fs_path.stat().st_mtime_ns):
+                stale[path] = str(fs_path)
+    return stale
+
+
+def get_missing_attachments(env: Environment) -> list[str]:
+    content_path = Path(env.root_path) / "content"
+    return [p for p in get_index(env)
+            if not (content_path / p.lstrip("/")).is_file()]
+
+
+def backfill(env: Environment, *, jobs: int | None = None) -> int:
+    missing = get_missing_attachments(env)
+    if len(missing) > 0:
+        with INDEX_LOCK:
+            index = get_index(env)
+            for path in missing:
+                index.pop(path, None)
+        save_index(env)
+    stale = get_stale_attachments(env)
+    if len(stale) == 0:
+        return 0
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        infos = executor.map(extract_metadata, stale.values(), chunksize=16)
+        with INDEX_LOCK:
+            index = get_index(env)
+            for path, info in zip(stale, infos):
+                index[path] = info
+    save_index(env)
+    return len(stale)
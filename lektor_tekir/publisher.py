@@ -0,0 +1,156 @@
+# Copyright (C) 2023 H. Turgut Uyar <uyar@tekir.org>
+#
+# lektor-tekir is released under the BSD license.
+# Read the included LICENSE.txt file for details.
+
+from __future__ import annotations
+
+import json
+import os
+import shutil
+from abc import ABCMeta, abstractmethod
+from hashlib import sha1
+from pathlib import Path
+from typing import Dict, Iterator, Tuple
+
+from lektor.environment import Environment
+from lektor.environment.config import ServerInfo
+from lektor.publisher import Publisher, publish
+from werkzeug import urls
+
+from . import utils
+
+
+# relative path -> (size, modification time, content hash)
+Manifest = Dict[str, Tuple[int, int, str]]
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class IncrementalPublisher(Publisher, metaclass=ABCMeta):
+    @abstractmethod
+    def publish_changes(self, target_url: urls.URL, *, changed: list[str],
+                        deleted: list[str], credentials=None,
+                        **extra) -> Iterator[str]:
+        ...
+
+    def publish(self, target_url, credentials=None, **extra):
+        manifest = get_manifest(Path(self.output_path))
+        return self.publish_changes(target_url, changed=sorted(manifest),
+                                    deleted=[], credentials=credentials,
+                                    **extra)
+
+
+class LocalDirectoryPublisher(IncrementalPublisher):
+    def publish_changes(self, target_url, *, changed, deleted,
+                        credentials=None, **extra):
+        target_path = Path(urls.url_unquote(target_url.path))
+        output_path = Path(self.output_path)
+        for name in changed:
+            dst = target_path / name
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy2(output_path / name, dst)
+            yield f"copied: {name}"
+        for name in deleted:
+            dst = target_path / name
+            dst.unlink(missing_ok=True)
+            yield f"deleted: {name}"
+            for parent in dst.parents:
+                if parent == target_path:
+                    break
+                if not parent.is_dir():
+                    # already removed on the target
+                    continue
+                try:
+                    parent.rmdir()
+                except OSError:
+                    # not empty
+                    break
+
+
+def hash_file(path: Path) -> str:
+    digest = sha1()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_manifest(output_path: Path, *,
+                 previous: Manifest | None = None) -> Manifest:
+    # hashes are only recomputed for files whose size or mtime have changed
+    known: Manifest = previous if previous is not None else {}
+    manifest: Manifest = {}
+    for dir_path, dir_names, file_names in os.walk(output_path):
+        dir_names[:] = [d for d in dir_names if d != ".lektor"]
+        for file_name in file_names:
+            path = Path(dir_path, file_name)
+            name = path.relative_to(output_path).as_posix()
+            stat = path.stat()
+            entry = known.get(name)
+            if (entry is not None) and \
+                    (entry[0], entry[1]) == (stat.st_size, stat.st_mtime_ns):
+                manifest[name] = entry
+            else:
+                manifest[name] = (stat.st_size, stat.st_mtime_ns,
+                                  hash_file(path))
+    return manifest
+
+
+def diff_manifests(old: Manifest,
+                   new: Manifest) -> tuple[list[str], list[str]]:
+    changed = sorted(k for k, v in new.items()
+                     if (k not in old) or (old[k][2] != v[2]))
+    deleted = sorted(k for k in old if k not in new)
+    return changed, deleted
+
+
+def get_manifest_path(env: Environment, server_id: str) -> Path:
+    return utils.get_cache_path(env) / f"publish-{server_id}.json"
+
+
+def load_manifest(env: Environment, server_info: ServerInfo) -> Manifest:
+    manifest_path = get_manifest_path(env, server_info.id)
+    if not manifest_path.exists():
+        return {}
+    data = json.loads(manifest_path.read_text())
+    if data.get("target") != server_info.target:
+        return {}
+    return {k: tuple(v) for k, v in data["files"].items()}
+
+
+def save_manifest(env: Environment, server_info: ServerInfo,
+                  manifest: Manifest) -> None:
+    manifest_path = get_manifest_path(env, server_info.id)
+    data = {"target": server_info.target, "files": manifest}
+    tmp_path = manifest_path.with_suffix(".tmp")
+    tmp_path.write_text(json.dumps(data))
+    tmp_path.replace(manifest_path)
+
+
+def publish_site(env: Environment, server_info: ServerInfo,
+                 output_path: str) -> Iterator[str]:
+    url = urls.url_parse(str(server_info.target))
+    publisher_class = env.publishers.get(url.scheme)
+    if (publisher_class is None) or \
+            (not issubclass(publisher_class, IncrementalPublisher)):
+        yield from publish(env, server_info.target, output_path,
+                           server_info=server_info)
+        return
+
+    previous = load_manifest(env, server_info)
+    manifest = get_manifest(Path(output_path), previous=previous)
+    changed, deleted = diff_manifests(previous, manifest)
+    if (len(changed) == 0) and (len(deleted) == 0):
+        yield "no changes"
+        return
+    publisher = publisher_class(env, output_path)
+    yield from publisher.publish_changes(url, changed=changed,
+                                         deleted=deleted,
+                                         server_info=server_info)
+    save_manifest(env, server_info, manifest)
+
+
+def register_publishers(env: Environment) -> None:
+    if "file" not in env.publishers:
+        env.add_publisher("file", LocalDirectoryPublisher)
@@ -0,0 +1,222 @@
+# Copyright (C) 2023 H. Turgut Uyar <uyar@tekir.org>
+#
+# lektor-tekir is released under the BSD license.
+# Read the included LICENSE.txt file for details.
+
+from __future__ import annotations
+
+import atexit
+import json
+import os
+import posixpath
+import re
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from threading import Lock
+from typing import Dict, List, Tuple
+
+from lektor.environment import Environment
+from lektor.metaformat import tokenize
+
+from . import utils, validation
+
+
+# target path, field name
+Reference = Tuple[str, str]
+
+# record path, alt, field name
+Referrer = Tuple[str, str, str]
+
+# record path, alt -> modification time, references
+SourceData = Dict[Tuple[str, str], Tuple[int, List[Reference]]]
+
+# markdown links and images, and HTML links and sources
+LINK_PATTERNS: list[re.Pattern] = [
+    re.compile(r"\]\(\s*<?([^)\s>]+)"),
+    re.compile(r"""\b(?:href|src)\s*=\s*["']([^"']+)["']"""),
+]
+
+# values of URL fields as filled in by the navigate dialog
+PATH_VALUE = re.compile(r"^/\S*$")
+
+SCHEME = re.compile(r"^[a-zA-Z][a-zA-Z0-9+.-]*:")
+
+INDEX_FILE = "references.json"
+
+# parse small batches of changes in the current process
+PARALLEL_THRESHOLD = 64
+
+# project id -> reference index
+INDEXES: dict[str, ReferenceIndex] = {}
+INDEX_LOCK = Lock()
+
+
+def normalize_target(path: str, target: str) -> str | None:
+    if target.startswith(("#", "//")) or (SCHEME.match(target) is not None):
+        return None
+    target = target.split("#")[0].split("?")[0]
+    if target == "":
+        return None
+    # relative links are resolved against the page's own URL
+    target = posixpath.normpath(posixpath.join(path, target))
+    if posixpath.basename(target) == "index.html":
+        target = posixpath.dirname(target)
+    return target
+
+
+def parse_source(path: str, fs_path: str) -> list[Reference]:
+    with open(fs_path, "rb") as f:
+        data = {k: "".join(v) for k, v in tokenize(f, encoding="utf-8")}
+    references: set[Reference] = set()
+    for field, value in data.items():
+        if field.startswith("_"):
+            continue
+        value = value.strip()
+        if PATH_VALUE.match(value) is not None:
+            target = normalize_target(path, value)
+            if target is not None:
+                references.add((target, field))
+            continue
+        for pattern in LINK_PATTERNS:
+            for match in pattern.finditer(value):
+                target = normalize_target(path, match.group(1))
+                if target is not None:
+                    references.add((target, field))
+    return sorted(r for r in references if r[0] != path)
+
+
+def parse_source_file(source_file: validation.SourceFile) -> list[Reference]:
+    path, alt, fs_path = source_file
+    return parse_source(path, fs_path)
+
+
+class ReferenceIndex:
+    def __init__(self, env: Environment) -> None:
+        self.env = env
+        self.sources: SourceData = {}
+        self.incoming: dict[str, set[Referrer]] = {}
+        # whether there are changes that haven't been saved yet
+        self.dirty = False
+
+    def add(self, path: str, alt: str, mtime: int,
+            references: list[Reference]) -> None:
+        self.remove(path, alt)
+        self.sources[(path, alt)] = (mtime, references)
+        for target, field in references:
+            self.incoming.setdefault(target, set()).add((path, alt, field))
+
+    def remove(self, path: str, alt: str) -> None:
+        data = self.sources.pop((path, alt), None)
+        if data is None:
+            return
+        for target, field in data[1]:
+            referrers = self.incoming.get(target)
+            if referrers is not None:
+                referrers.discard((path, alt, field))
+                if len(referrers) == 0:
+                    del self.incoming[target]
+
+    def scan(self, path: str = "/", *, jobs: int | None = None) -> int:
+        # only the sources that have changed since the last scan are parsed,
+        # returns the number of changed sources
+        source_files = validation.get_source_files(self.env, path)
+        found: set[tuple[str, str]] = set()
+        stale: list[validation.SourceFile] = []
+        mtimes: list[int] = []
+        for source_file in source_files:
+            key = (source_file[0], source_file[1])
+            found.add(key)
+            mtime = os.stat(source_file[2]).st_mtime_ns
+            data = self.sources.get(key)
+            if (data is None) or (data[0] != mtime):
+                stale.append(source_file)
+                mtimes.append(mtime)
+        prefix = path.rstrip("/") + "/"
+        removed = [k for k in self.sources
+                   if ((k[0] == path) or k[0].startswith(prefix)) and
+                   (k not in found)]
+        for key in removed:
+            self.remove(*key)
+        if len(stale) > PARALLEL_THRESHOLD:
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                results = list(executor.map(parse_source_file, stale,
+                                            chunksize=64))
+        else:
+            results = [parse_source_file(s) for s in stale]
+        for (src_path, alt, _), mtime, references in \
+                zip(stale, mtimes, results):
+            self.add(src_path, alt, mtime, references)
+        n_changes = len(stale) + len(removed)
+        if n_changes > 0:
+            self.dirty = True
+        return n_changes
+
+    def get_referrers(self, targets: list[str]) -> list[Referrer]:
+        referrers: set[Referrer] = set()
+        for target in targets:
+            referrers.update(self.incoming.get(target, ()))
+        return sorted(referrers)
+
+    def load(self, data: list) -> None:
+        for path, alt, mtime, references in data:
+            self.add(path, alt, mtime, [tuple(r) for r in references])
+
+    def dump(self) -> list:
+        return [[path, alt, mtime, references]
+                for (path, alt), (mtime, references) in self.sources.items()]
+
+
+def get_index(env: Environment) -> ReferenceIndex:
+    with INDEX_LOCK:
+        index = INDEXES.get(env.project.id)
+        if index is None:
+            index = ReferenceIndex(env)
+            index_path = utils.get_cache_path(env) / INDEX_FILE
+            if index_path.exists():
+                index.load(json.loads(index_path.read_text()))
+            if index.scan() > 0:
+                save_index(index)
+            # changes after this are saved once, on exit
+            atexit.register(save_changed_index, index)
+            INDEXES[env.project.id] = index
+        return index
+
+
+def save_index(index: ReferenceIndex) -> None:
+    index_path = utils.get_cache_path(index.env) / INDEX_FILE
+    tmp_path = index_path.with_suffix(".tmp")
+    tmp_path.write_text(json.dumps(index.dump()))
+    tmp_path.replace(index_path)
+    index.dirty = False
+
+
+def save_changed_index(index: ReferenceIndex) -> None:
+    with INDEX_LOCK:
+        if index.dirty:
+            save_index(index)
+
+
+def refresh_references(env: Environment, path: str) -> None:
+    with INDEX_LOCK:
+        index = INDEXES.get(env.project.id)
+        if index is not None:
+            index.scan(path)
+
+
+def get_target_paths(fs_paths: list[Path]) -> list[str]:
+    # paths of the records and attachments that are in the given files
+    targets: set[str] = set()
+    for fs_path in fs_paths:
+        if (fs_path.name == "contents.lr") or \
+                fs_path.name.startswith("contents+"):
+            parent = fs_path.parent.as_posix()
+            targets.add("/" if parent == "." else f"/{parent}")
+        elif fs_path.suffix != ".lr":
+            targets.add(f"/{fs_path.as_posix()}")
+    return sorted(targets)
+
+
+def get_referrers(env: Environment, targets: list[str]) -> list[Referrer]:
+    index = get_index(env)
+    with INDEX_LOCK:
+        return index.get_referrers(targets)
@@ -25,6 +25,24 @@ window.addEventListener("DOMContentLoaded", (loadEvent) => {
             } else if (el.classList.contains("down-block")) {
                 details.nextElementSibling.after(details);
             }
+        } else if (el.classList.contains("raw-upload")) {
+            ev.preventDefault();
+            const file = el.closest("form").querySelector("input[type=file]").files[0];
+            if (!file) {
+                return;
+            }
+            fetch(el.dataset.url, {method: "POST", body: file, headers: {"Content-Type": "application/x-tar"}})
+                .then(async (response) => {
+                    const redirect = response.headers.get("HX-Redirect");
+                    if (redirect) {
+                        window.location.href = redirect;
+                    } else {
+                        el.closest("dialog").close();
+                        const errorDialog = document.getElementById("error-dialog");
+                        errorDialog.innerHTML = await response.text();
+                        errorDialog.showModal();
+                    }
+                });
         } else if (el.id == "navigate-select") {
             ev.preventDefault();
             document.getElementById(el.dataset.dst).value = document.getElementById("navigables").value;
@@ -0,0 +1,214 @@
+# Copyright (C) 2023 H. Turgut Uyar <uyar@tekir.org>
+#
+# lektor-tekir is released under the BSD license.
+# Read the included LICENSE.txt file for details.
+
+from __future__ import annotations
+
+import json
+import os
+import posixpath
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from lektor.constants import PRIMARY_ALT
+from lektor.db import Database
+from lektor.metaformat import tokenize
+
+
+# path, explicit slugs per alt, explicit model, alts, modification time
+NodeData = Tuple[str, Optional[Dict[str, str]], Optional[str], List[str], int]
+
+
+class TreeNode:
+    __slots__ = ("path", "slugs", "model", "alts", "mtime", "children")
+
+    def __init__(self, path: str, slugs: dict[str, str] | None,
+                 model: str | None, alts: list[str], mtime: int) -> None:
+        self.path = path
+        self.slugs = slugs
+        self.model = model
+        self.alts = alts
+        self.mtime = mtime
+        self.children: list[TreeNode] = []
+
+    @property
+    def id(self) -> str:
+        return posixpath.basename(self.path)
+
+    def to_data(self) -> NodeData:
+        return (self.path, self.slugs, self.model, self.alts, self.mtime)
+
+
+def read_system_fields(fs_path: str) -> dict[str, str]:
+    with open(fs_path, "rb") as f:
+        tokens = tokenize(f, interesting_keys={"_model", "_slug"},
+                          encoding="utf-8")
+        return {k: "".join(v).strip() for k, v in tokens if v is not None}
+
+
+def join_path(parent: str, name: str) -> str:
+    return f"{parent}/{name}" if parent != "/" else f"/{name}"
+
+
+class TreeIndex:
+    def __init__(self, db: Database) -> None:
+        self.db = db
+        self.content_path = Path(db.env.root_path) / "content"
+        self.nodes: dict[str, TreeNode] = {}
+
+    def scan(self, path: str = "/", *,
+             previous: dict[str, NodeData] | None = None) -> TreeNode | None:
+        # nodes whose contents files have not changed are taken from
+        # the previous data without reading the files again
+        known = previous if previous is not None else {}
+        env = self.db.env
+        root_node: TreeNode | None = None
+        stack: list[tuple[str, TreeNode | None]] = [(path, None)]
+        while len(stack) > 0:
+            node_path, parent_node = stack.pop()
+            fs_path = self.db.to_fs_path(node_path)
+            sources: dict[str, str] = {}
+            sub_dirs: list[str] = []
+            mtime = 0
+            try:
+                entries = list(os.scandir(fs_path))
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            for entry in entries:
+                name = entry.name
+                if entry.is_dir():
+                    if not env.is_uninteresting_source_name(name):
+                        sub_dirs.append(name)
+                    continue
+                if name == "contents.lr":
+                    alt = PRIMARY_ALT
+                elif name.startswith("contents+") and name.endswith(".lr"):
+                    alt = name[9:-3]
+                else:
+                    continue
+                sources[alt] = entry.path
+                mtime = max(mtime, entry.stat().st_mtime_ns)
+            if len(sources) == 0:
+                continue
+
+            alts = sorted(sources)
+            data = known.get(node_path)
+            if (data is not None) and (data[4] == mtime):
+                slugs, model = data[1], data[2]
+            else:
+                slugs, model = None, None
+                for alt, source in sources.items():
+                    fields = read_system_fields(source)
+                    if fields.get("_slug"):
+                        slugs = slugs if slugs is not None else {}
+                        slugs[alt] = fields["_slug"]
+                    if (alt == PRIMARY_ALT) and fields.get("_model"):
+                        model = fields["_model"]
+            node = TreeNode(node_path, slugs, model, alts, mtime)
+            self.nodes[node_path] = node
+            if parent_node is not None:
+                parent_node.children.append(node)
+            else:
+                root_node = node
+            for name in sorted(sub_dirs, reverse=True):
+                stack.append((join_path(node_path, name), node))
+        return root_node
+
+    def load(self, data: list[NodeData]) -> None:
+        previous = {d[0]: d for d in data}
+        self.nodes.clear()
+        self.scan("/", previous=previous)
+
+    def dump(self) -> list[NodeData]:
+        return [n.to_data() for n in self.iter_subtree("/")]
+
+    def refresh(self, path: str) -> None:
+        node = self.nodes.get(path)
+        parent = self.nodes.get(posixpath.dirname(path)) \
+            if path != "/" else None
+        if (path != "/") and (parent is None):
+            self.refresh(posixpath.dirname(path))
+            return
+        previous: dict[str, NodeData] = {}
+        if node is not None:
+            for item in list(self.iter_subtree(path)):
+                previous[item.path] = item.to_data()
+                del self.nodes[item.path]
+            if parent is not None:
+                parent.children.remove(node)
+        new_node = self.scan(path, previous=previous)
+        if (new_node is not None) and (parent is not None):
+            parent.children.append(new_node)
+            parent.children.sort(key=lambda n: n.path)
+
+    def get(self, path: str) -> TreeNode | None:
+        return self.nodes.get(path)
+
+    def iter_subtree(self, path: str):
+        node = self.nodes.get(path)
+        stack = [node] if node is not None else []
+        while len(stack) > 0:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node.children))
+
+    def count(self, path: str) -> int:
+        return sum(1 for _ in self.iter_subtree(path))
+
+    def get_parent(self, node: TreeNode) -> TreeNode | None:
+        if node.path == "/":
+            return None
+        return self.nodes.get(posixpath.dirname(node.path))
+
+    def get_ancestors(self, path: str) -> list[TreeNode]:
+        ancestors: list[TreeNode] = []
+        node = self.nodes.get(path)
+        while node is not None:
+            node = self.get_parent(node)
+            if node is not None:
+                ancestors.append(node)
+        ancestors.reverse()
+        return ancestors
+
+    def get_model(self, node: TreeNode) -> str:
+        datamodels = self.db.datamodels
+        if (node.model is not None) and (node.model in datamodels):
+            return node.model
+        implied: str | None = None
+        parent = self.get_parent(node)
+        if parent is not None:
+            implied = datamodels[self.get_model(parent)].child_config.model
+        choices = [implied, node.id.split(".")[0].replace("-", "_").lower(),
+                   "page"]
+        for choice in choices:
+            if (choice is not None) and (choice in datamodels):
+                return choice
+        return "none"
+
+    def get_slug(self, node: TreeNode, alt: str = PRIMARY_ALT) -> str | None:
+        # None means that the slug can only be computed by Lektor
+        if node.slugs is not None:
+            slug = node.slugs.get(alt) or node.slugs.get(PRIMARY_ALT)
+            if slug is not None:
+                return slug
+        parent = self.get_parent(node)
+        if parent is None:
+            return ""
+        parent_model = self.db.datamodels[self.get_model(parent)]
+        if parent_model.child_config.slug_format is not None:
+            return None
+        return node.id
+
+
+def load_index(db: Database, index_path: Path) -> TreeIndex:
+    index = TreeIndex(db)
+    data = json.loads(index_path.read_text()) if index_path.exists() else []
+    index.load(data)
+    return index
+
+
+def save_index(index: TreeIndex, index_path: Path) -> None:
+    tmp_path = index_path.with_suffix(".tmp")
+    tmp_path.write_text(json.dumps(index.dump()))
+    tmp_path.replace(index_path)
@@ -0,0 +1,184 @@
+# Copyright (C) 2023 H. Turgut Uyar <uyar@tekir.org>
+#
+# lektor-tekir is released under the BSD license.
+# Read the included LICENSE.txt file for details.
+
+from __future__ import annotations
+
+import json
+import os
+import posixpath
+from pathlib import Path
+from threading import Lock
+from typing import Dict, Optional, Tuple
+
+from lektor.builder import Builder
+from lektor.environment import Environment
+from lektor.pluginsystem import Plugin, get_plugin
+
+from . import utils
+
+
+# artifact name -> (record path, size)
+Usage = Dict[str, Tuple[Optional[str], int]]
+
+USAGE_FILE = "usage.json"
+
+PLUGIN_ID = "tekir-usage"
+
+# artifacts that don't come from a content item (assets, templates, ...)
+NO_RECORD = ""
+
+# artifacts without a file name extension
+NO_SUFFIX = ""
+
+
+class UsagePlugin(Plugin):
+    # build events are emitted for every builder of the environment,
+    # including the background builder of the development server
+    name = "Tekir output usage"
+    description = "Keeps track of the sizes of built artifacts."
+
+    def __init__(self, env: Environment, id: str) -> None:
+        super().__init__(env, id)
+        self.lock = Lock()
+        self.usage: Usage | None = None
+
+    def get_usage(self, builder: Builder) -> Usage:
+        with self.lock:
+            if self.usage is None:
+                self.usage = load_usage(builder)
+            return dict(self.usage)
+
+    def on_before_build_all(self, builder, **extra):
+        # another server process may have built since the last load
+        with self.lock:
+            self.usage = load_usage(builder)
+
+    def on_after_build(self, builder, build_state, source, prog, **extra):
+        updated = {a.artifact_name for a in build_state.updated_artifacts}
+        record = getattr(source, "record", None)
+        record_path = record.path if record is not None else None
+        with self.lock:
+            if self.usage is None:
+                self.usage = load_usage(builder)
+            for artifact in prog.artifacts:
+                name: str = artifact.artifact_name
+                if (name not in updated) and (name in self.usage):
+                    continue
+                try:
+                    size = os.stat(artifact.dst_filename).st_size
+                except OSError:
+                    continue
+                self.usage[name] = (record_path, size)
+
+    def on_after_build_all(self, builder, **extra):
+        with self.lock:
+            if self.usage is not None:
+                save_usage(builder, self.usage)
+
+    def on_after_prune(self, builder, **extra):
+        with self.lock:
+            if self.usage is None:
+                self.usage = load_usage(builder)
+            for name in list(self.usage):
+                dst_filename = os.path.join(builder.destination_path, name)
+                if not os.path.exists(dst_filename):
+                    del self.usage[name]
+            save_usage(builder, self.usage)
+
+
+def get_record_path(source: str) -> str | None:
+    # sources in the build state are relative to the project folder
+    try:
+        rel_path = Path(source).relative_to("content")
+    except ValueError:
+        return None
+    if rel_path.name.startswith("contents") and rel_path.suffix == ".lr":
+        rel_path = rel_path.parent
+    elif rel_path.suffix == ".lr":
+        rel_path = rel_path.with_suffix("")
+    return "/" + rel_path.as_posix() if rel_path.parts else "/"
+
+
+def seed_usage(builder: Builder) -> Usage:
+    # one-time fill from the build state, later builds update incrementally
+    usage: Usage = {}
+    if not os.path.exists(builder.buildstate_database_filename):
+        return usage
+    con = builder.connect_to_database()
+    try:
+        rows = con.execute("SELECT artifact, source FROM artifacts"
+                           " WHERE is_primary_source").fetchall()
+    finally:
+        con.close()
+    for artifact_name, source in rows:
+        dst_filename = os.path.join(builder.destination_path, artifact_name)
+        try:
+            size = os.stat(dst_filename).st_size
+        except OSError:
+            continue
+        usage[artifact_name] = (get_record_path(source), size)
+    return usage
+
+
+def load_usage(builder: Builder) -> Usage:
+    usage_path = utils.get_cache_path(builder.env) / USAGE_FILE
+    if not usage_path.exists():
+        return seed_usage(builder)
+    data = json.loads(usage_path.read_text())
+    return {k: (v[0], v[1]) for k, v in data.items()}
+
+
+def save_usage(builder: Builder, usage: Usage) -> None:
+    usage_path = utils.get_cache_path(builder.env) / USAGE_FILE
+    tmp_path = usage_path.with_suffix(".tmp")
+    tmp_path.write_text(json.dumps(usage))
+    tmp_path.replace(usage_path)
+
+
+def register_usage_tracking(env: Environment) -> None:
+    if PLUGIN_ID not in env.plugins:
+        env.plugin_controller.instanciate_plugin(PLUGIN_ID, UsagePlugin)
+
+
+def get_usage(builder: Builder) -> Usage:
+    plugin: UsagePlugin = get_plugin(PLUGIN_ID, builder.env)
+    return plugin.get_usage(builder)
+
+
+def get_file_type(artifact_name: str) -> str:
+    suffix = posixpath.splitext(artifact_name)[1].lower()
+    return suffix if suffix != "" else NO_SUFFIX
+
+
+def summarize_usage(usage: Usage, path: str) -> dict[str, list]:
+    # sizes of the subtrees below the given path, and of file types in it
+    prefix = path.rstrip("/") + "/"
+    sections: dict[str, list[int]] = {}
+    file_types: dict[str, list[int]] = {}
+    for artifact_name, (record_path, size) in usage.items():
+        if record_path is None:
+            if path != "/":
+                continue
+            section = NO_RECORD
+        elif record_path == path:
+            section = path
+        elif record_path.startswith(prefix):
+            child = record_path[len(prefix):].split("/")[0]
+            section = prefix + child
+        else:
+            continue
+        totals = sections.setdefault(section, [0, 0])
+        totals[0] += size
+        totals[1] += 1
+        file_type = get_file_type(artifact_name)
+        totals = file_types.setdefault(file_type, [0, 0])
+        totals[0] += size
+        totals[1] += 1
+    return {
+        "sections": sorted(((k, *v) for k, v in sections.items()),
+                           key=lambda s: s[1], reverse=True),
+        "file_types": sorted(((k, *v) for k, v in file_types.items()),
+                             key=lambda s: s[1], reverse=True),
+    }
@@ -5,23 +5,34 @@
 
 from __future__ import annotations
 
+import atexit
+import os
+import posixpath
 from datetime import datetime
 from http import HTTPStatus
 from locale import strxfrm
 from pathlib import Path
 from shutil import rmtree
+from threading import RLock
 from typing import Mapping
 from uuid import uuid4
 
 from lektor.builder import Builder
 from lektor.constants import PRIMARY_ALT
+from lektor.context import Context
 from lektor.datamodel import DataModel, Field, FlowBlockModel
-from lektor.db import Alt, Pad, Page, Record
+from lektor.db import Alt, Database, Pad, Page, Record
+from lektor.environment import Environment
+from lektor.metaformat import tokenize
 from lektor.types.flow import FlowBlock
+from lektor.utils import get_cache_dir
 from slugify import slugify
 from werkzeug.datastructures.file_storage import FileStorage
 from werkzeug.datastructures.structures import ImmutableMultiDict
 
+from .treeindex import TreeIndex, TreeNode, load_index, save_index
+from .writer import write_source
+
 
 BOOL_VALUES: dict[str, str] = {"true": "yes", "false": "no",
                                "1": "yes", "0": "no"}
@@ -32,15 +43,63 @@ BLOCK_SEP = "----\n"
 
 SYSTEM_FIELDS: list[str] = ["_slug", "_template", "_hidden", "_discoverable"]
 
+# project id -> parent path -> names of existing children
+# (subpage folders and attachments)
+SLUG_INDEXES: dict[str, dict[str, set[str]]] = {}
+
+# project id -> content tree index
+TREE_INDEXES: dict[str, TreeIndex] = {}
+TREE_INDEX_FILE = "tree.json"
+
+# requests are handled in threads, readers must not see a half refreshed tree
+TREE_INDEX_LOCK = RLock()
+
 
 def i18n_name(item: DataModel | Alt, lang_code: str) -> str:
     return strxfrm(item.name_i18n.get(lang_code, item.id))
 
 
+def get_cache_path(env: Environment) -> Path:
+    cache_path = Path(get_cache_dir()) / "tekir" / env.project.id
+    cache_path.mkdir(parents=True, exist_ok=True)
+    return cache_path
+
+
+def get_tree_index(env: Environment) -> TreeIndex:
+    with TREE_INDEX_LOCK:
+        tree_index = TREE_INDEXES.get(env.project.id)
+        if tree_index is None:
+            index_path = get_cache_path(env) / TREE_INDEX_FILE
+            tree_index = load_index(Database(env), index_path)
+            save_index(tree_index, index_path)
+            atexit.register(save_tree_index, tree_index, index_path)
+            TREE_INDEXES[env.project.id] = tree_index
+        return tree_index
+
+
+def save_tree_index(tree_index: TreeIndex, index_path: Path) -> None:
+    with TREE_INDEX_LOCK:
+        save_index(tree_index, index_path)
+
+
+def refresh_tree_index(env: Environment, path: str) -> None:
+    with TREE_INDEX_LOCK:
+        tree_index = TREE_INDEXES.get(env.project.id)
+        if tree_index is not None:
+            tree_index.refresh(path)
+
+
+def get_node_slug(pad: Pad, tree_index: TreeIndex, node: TreeNode, *,
+                  alt: str) -> str:
+    slug = tree_index.get_slug(node, alt=alt)
+    if slug is None:
+        slug = pad.get(node.path, alt=alt)["_slug"]
+    return slug
+
+
 def get_page_count(record: Record) -> int:
-    fs_path = Path(record.source_filename).parent
-    pages = {c.parent for c in fs_path.glob("**/contents*.lr")}
-    return len(pages)
+    with TREE_INDEX_LOCK:
+        return get_tree_index(record.pad.env).count(record.path)
 
 
 def get_build_time(builder: Builder) -> datetime | None:
@@ -66,13 +125,14 @@ def get_record(pad: Pad, args: Mapping[str, str], *,
     return (record, HTTPStatus.OK)
 
 
-def get_ancestors(record: Record) -> list[Record]:
-    ancestors: list[Record] = []
-    current = record
-    while current.parent:
-        current = record.pad.get(current.parent.path, alt=current.alt)
-        ancestors.append(current)
-    ancestors.reverse()
+def get_ancestors(record: Record) -> list[tuple[str, str]]:
+    ancestors: list[tuple[str, str]] = []
+    with TREE_INDEX_LOCK:
+        tree_index = get_tree_index(record.pad.env)
+        for node in tree_index.get_ancestors(record.path):
+            slug = get_node_slug(record.pad, tree_index, node,
+                                 alt=record.alt)
+            ancestors.append((node.path, slug))
     return ancestors
 
 
@@ -104,8 +164,8 @@ def get_navigables(record: Record) -> list[tuple[str, str, bool]]:
         ("", "----", False),
         ("/", "/", record.path == "/"),
     ]
-    for ancestor in get_ancestors(record)[1:]:
-        options.append((ancestor.path, ancestor["_slug"], False))
+    for path, slug in get_ancestors(record)[1:]:
+        options.append((path, slug, False))
     if record.path != "/":
         options.append((record.path, record["_slug"], True))
     for child in record.children:
@@ -113,6 +173,39 @@ def get_navigables(record: Record) -> list[tuple[str, str, bool]]:
     return options
 
 
+def get_child_slugs(pad: Pad, parent: str) -> set[str]:
+    slug_index = SLUG_INDEXES.setdefault(pad.env.project.id, {})
+    slugs = slug_index.get(parent)
+    if slugs is None:
+        fs_path = Path(pad.db.to_fs_path(parent))
+        with os.scandir(fs_path) as entries:
+            slugs = {e.name for e in entries if not e.name.endswith(".lr")}
+        slug_index[parent] = slugs
+    return slugs
+
+
+def drop_child_slugs(env: Environment, path: str) -> None:
+    # the entries of the item itself and of everything below it
+    slug_index = SLUG_INDEXES.get(env.project.id, {})
+    prefix = path.rstrip("/") + "/"
+    for key in [p for p in slug_index if (p == path) or p.startswith(prefix)]:
+        del slug_index[key]
+
+
+def forget_child_slugs(env: Environment, path: str) -> None:
+    drop_child_slugs(env, path)
+    SLUG_INDEXES.get(env.project.id, {}).pop(posixpath.dirname(path), None)
+
+
+def get_free_slug(slugs: set[str], slug: str) -> str:
+    if slug not in slugs:
+        return slug
+    counter = 2
+    while f"{slug}-{counter}" in slugs:
+        counter += 1
+    return f"{slug}-{counter}"
+
+
 def field_entry(record: Record, field: Field, form: Mapping[str, str], *,
                 form_field: str | None = None,
                 primary: Record | None = None) -> str:
@@ -200,7 +293,32 @@ def get_source(record: Record, form: Mapping[str, str], *,
     return ENTRY_SEP.join(entries)
 
 
+def render_preview(record: Record, source: str) -> str:
+    pad: Pad = record.pad
+    stored: dict[str, str] = pad.db.load_raw_data(record.path, alt=record.alt)
+    raw_data: dict[str, str] = {k: v for k, v in stored.items()
+                                if k.startswith("_") and
+                                (k not in SYSTEM_FIELDS)}
+    for key, lines in tokenize(source.splitlines(keepends=True)):
+        raw_data[key] = "".join(lines)
+    preview: Record = pad.instance_from_data(raw_data,
+                                             datamodel=record.datamodel)
+    with Context(pad=pad) as ctx:
+        ctx.source = preview
+        html: str = pad.env.render_template(preview["_template"], pad=pad,
+                                            this=preview)
+    base = f'<base href="{preview.url_path}">'
+    return html.replace("<head>", f"<head>{base}", 1)
+
+
 def delete_record(record: Record) -> None:
+    parent: Record | None = record.parent
+    env: Environment = record.pad.env
+    if parent is not None:
+        slugs = SLUG_INDEXES.get(env.project.id, {}).get(parent.path)
+        if slugs is not None:
+            slugs.discard(posixpath.basename(record.path))
+    drop_child_slugs(env, record.path)
     if record.is_attachment:
         filename: str = record.source_filename.rstrip(".lr")
         Path(filename).unlink()
@@ -213,8 +331,11 @@ def create_subpage(*, pad: Pad, parent: str, model: str, title: str,
                    form: Mapping[str, str]) -> str:
     slug: str = form.get("_slug") or slugify(title)
     path = f"{parent}/{slug}" if parent != "/" else f"/{slug}"
+    # the slug index is only a hint, the file system decides
+    slugs = get_child_slugs(pad, parent)
     fs_path = Path(pad.db.to_fs_path(path))
     if fs_path.exists():
+        slugs.add(slug)
         raise FileExistsError("Duplicate slug")
 
     data: dict[str, str] = {
@@ -227,9 +348,10 @@ def create_subpage(*, pad: Pad, parent: str, model: str, title: str,
     page = Page(data=data, pad=pad)
 
     fs_path.mkdir()
+    slugs.add(slug)
     source_file = Path(page.source_filename)
     source = get_source(page, dict(**form, _discoverable="on"))
-    source_file.write_text(source)
+    write_source(source_file, source)
     return path
 
 
@@ -249,7 +371,7 @@ def create_translation(*, pad: Pad, record: Record, alt: str,
     primary: Record = pad.get(record.path, alt=PRIMARY_ALT)
     source = get_source(page, dict(**form, _discoverable="on"),
                         primary=primary)
-    source_file.write_text(source)
+    write_source(source_file, source)
 
 
 def create_attachment(*, pad: Pad, parent: Record,
@@ -258,10 +380,13 @@ def create_attachment(*, pad: Pad, parent: Record,
     if slug is None:
         slug = uuid4().hex
     path = f"{parent.path}/{slug}" if parent.path != "/" else f"/{slug}"
+    slugs = get_child_slugs(pad, parent.path)
     fs_path = Path(pad.db.to_fs_path(path))
     if fs_path.exists():
+        slugs.add(slug)
         raise FileExistsError("Duplicate slug")
     uploaded.save(fs_path)
+    slugs.add(slug)
     return path
 
 
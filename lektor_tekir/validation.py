@@ -0,0 +1,155 @@
+# Copyright (C) 2023 H. Turgut Uyar <uyar@tekir.org>
+#
+# lektor-tekir is released under the BSD license.
+# Read the included LICENSE.txt file for details.
+
+from __future__ import annotations
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import List, Mapping, Tuple
+
+from flask_babel import lazy_gettext as _
+from lektor.constants import PRIMARY_ALT
+from lektor.datamodel import DataModel, Field
+from lektor.db import Database, Pad
+from lektor.environment import Environment
+from lektor.metaformat import tokenize
+from lektor.project import Project
+from lektor.types.base import BadValue, RawValue, get_undefined_info
+from lektor.types.flow import BadFlowBlock, process_flowblock_data
+
+
+# record path, alt, field name, message id, detail
+ValidationError = Tuple[str, str, str, str, str]
+
+# field name, message id, detail
+FieldError = Tuple[str, str, str]
+
+MESSAGES = {
+    "unknown-field": _("Unknown field"),
+    "invalid-value": _("Invalid value"),
+    "invalid-flow": _("Invalid flow block data"),
+    "unknown-flow-block": _("Unknown flow block type"),
+    "flow-block-not-allowed": _("Flow block type not allowed"),
+    "unknown-model": _("Unknown model"),
+    "missing-model": _("Missing model"),
+}
+
+# record path, alt, source file
+SourceFile = Tuple[str, str, str]
+
+WORKER_PAD: Pad | None = None
+
+
+def init_worker(project_path: str) -> None:
+    global WORKER_PAD
+    # plugins can provide field types that the models use
+    env = Project.from_path(project_path).make_env(load_plugins=True)
+    WORKER_PAD = Database(env).new_pad()
+
+
+def check_fields(pad: Pad, fields: Mapping[str, Field],
+                 data: Mapping[str, str], *,
+                 prefix: str = "") -> List[FieldError]:
+    errors: List[FieldError] = []
+    for key, value in data.items():
+        field = fields.get(key)
+        if field is None:
+            if not key.startswith("_"):
+                errors.append((f"{prefix}{key}", "unknown-field", ""))
+            continue
+        if field.type.name == "flow":
+            errors.extend(check_flow(pad, field, value,
+                                     prefix=f"{prefix}{key}"))
+            continue
+        raw = RawValue(key, value, field=field, pad=pad)
+        result = field.type.value_from_raw(raw)
+        if isinstance(result, BadValue):
+            errors.append((f"{prefix}{key}", "invalid-value",
+                           get_undefined_info(result)))
+    return errors
+
+
+def check_flow(pad: Pad, field: Field, value: str, *,
+               prefix: str) -> List[FieldError]:
+    try:
+        blocks = process_flowblock_data(value)
+    except BadFlowBlock as e:
+        return [(prefix, "invalid-flow", str(e))]
+
+    allowed: list[str] | None = field.type.flow_blocks
+    errors: List[FieldError] = []
+    for i, (block_type, block_lines) in enumerate(blocks, start=1):
+        block_prefix = f"{prefix}-{i}-{block_type}"
+        block_model = pad.db.flowblocks.get(block_type)
+        if block_model is None:
+            errors.append((block_prefix, "unknown-flow-block", ""))
+            continue
+        if (allowed is not None) and (block_type not in allowed):
+            errors.append((block_prefix, "flow-block-not-allowed", ""))
+            continue
+        block_data = {k: "".join(v) for k, v in tokenize(block_lines)}
+        errors.extend(check_fields(pad, block_model.field_map, block_data,
+                                   prefix=f"{block_prefix}-"))
+    return errors
+
+
+def validate_source(source_file: SourceFile) -> List[ValidationError]:
+    path, alt, fs_path = source_file
+    pad = WORKER_PAD
+    if pad is None:
+        raise RuntimeError("Validation worker not initialized")
+
+    with open(fs_path, "rb") as f:
+        data = {k: "".join(v) for k, v in tokenize(f, encoding="utf-8")}
+
+    model_id: str | None = data.get("_model", "").strip() or None
+    if (model_id is None) and (alt != PRIMARY_ALT):
+        primary = pad.db.load_raw_data(path, alt=PRIMARY_ALT, fallback=False)
+        if primary is not None:
+            model_id = primary.get("_model", "").strip() or None
+    if (model_id is not None) and (model_id not in pad.db.datamodels):
+        return [(path, alt, "_model", "unknown-model", model_id)]
+
+    model: DataModel = pad.db.get_implied_datamodel(path, pad=pad,
+                                                    datamodel=model_id)
+    if model.id == "none":
+        return [(path, alt, "_model", "missing-model", "")]
+
+    errors = check_fields(pad, model.field_map, data)
+    return [(path, alt, field, message, detail)
+            for field, message, detail in errors]
+
+
+def get_source_files(env: Environment, path: str = "/") -> List[SourceFile]:
+    content_path = Path(env.root_path) / "content"
+    source_files: List[SourceFile] = []
+    for dir_path, dir_names, file_names in os.walk(content_path /
+                                                   path.lstrip("/")):
+        dir_names.sort()
+        rel_path = Path(dir_path).relative_to(content_path).as_posix()
+        path = "/" if rel_path == "." else f"/{rel_path}"
+        for file_name in sorted(file_names):
+            if file_name == "contents.lr":
+                alt = PRIMARY_ALT
+            elif file_name.startswith("contents+") and \
+                    file_name.endswith(".lr"):
+                alt = file_name[9:-3]
+            else:
+                continue
+            source_files.append((path, alt, os.path.join(dir_path, file_name)))
+    return source_files
+
+
+def validate_site(env: Environment, *,
+                  jobs: int | None = None) -> List[ValidationError]:
+    source_files = get_source_files(env)
+    errors: List[ValidationError] = []
+    with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker,
+                             initargs=(env.project.tree,)) as executor:
+        for result in executor.map(validate_source, source_files,
+                                   chunksize=64):
+            errors.extend(result)
+    return errors
@@ -0,0 +1,135 @@
+# Copyright (C) 2023 H. Turgut Uyar <uyar@tekir.org>
+#
+# lektor-tekir is released under the BSD license.
+# Read the included LICENSE.txt file for details.
+
+from __future__ import annotations
+
+import os
+import tempfile
+import time
+from pathlib import Path
+from threading import Lock, Thread
+
+from flask import current_app
+
+
+# "always": sync every write, "batch": sync in the background every second
+FSYNC_MODES: set[str] = {"none", "always", "batch"}
+
+BATCH_INTERVAL = 1.0
+
+# read once, changing the umask is not thread-safe
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+
+def fsync_path(path: str, *, directory: bool = False) -> None:
+    flags = os.O_RDONLY | (getattr(os, "O_DIRECTORY", 0) if directory else 0)
+    try:
+        fd = os.open(path, flags)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class ContentWriter:
+    def __init__(self, *, fsync: str = "none") -> None:
+        if fsync not in FSYNC_MODES:
+            raise ValueError(f"Unknown fsync mode: '{fsync}'")
+        self.fsync = fsync
+        self.lock = Lock()
+        self.pending: dict[str, str] = {}
+        self.path_locks: dict[str, Lock] = {}
+        self.unsynced: set[str] = set()
+        self.n_writes = 0
+        self.n_coalesced = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        if fsync == "batch":
+            thread = Thread(target=self.sync_loop, name="tekir-fsync",
+                            daemon=True)
+            thread.start()
+
+    def write(self, fs_path: Path, text: str) -> None:
+        key = str(fs_path)
+        with self.lock:
+            self.pending[key] = text
+            path_lock = self.path_locks.setdefault(key, Lock())
+        with path_lock:
+            with self.lock:
+                latest = self.pending.pop(key, None)
+            if latest is None:
+                # a concurrent save has already written a newer version
+                with self.lock:
+                    self.n_coalesced += 1
+                return
+            start = time.perf_counter()
+            self.replace(key, latest)
+            elapsed = time.perf_counter() - start
+        with self.lock:
+            self.n_writes += 1
+            self.total_time += elapsed
+            self.max_time = max(self.max_time, elapsed)
+
+    def replace(self, path: str, text: str) -> None:
+        dir_path = os.path.dirname(path)
+        fd, tmp_path = tempfile.mkstemp(dir=dir_path, prefix=".tekir-",
+                                        suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(text)
+                if self.fsync == "always":
+                    f.flush()
+                    os.fsync(f.fileno())
+            if os.path.exists(path):
+                os.chmod(tmp_path, os.stat(path).st_mode & 0o777)
+            else:
+                os.chmod(tmp_path, 0o666 & ~UMASK)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        if self.fsync == "always":
+            fsync_path(dir_path, directory=True)
+        elif self.fsync == "batch":
+            with self.lock:
+                self.unsynced.add(path)
+
+    def sync(self) -> None:
+        with self.lock:
+            paths, self.unsynced = self.unsynced, set()
+        for path in paths:
+            fsync_path(path)
+        for dir_path in {os.path.dirname(p) for p in paths}:
+            fsync_path(dir_path, directory=True)
+
+    def sync_loop(self) -> None:
+        while True:
+            time.sleep(BATCH_INTERVAL)
+            self.sync()
+
+    def get_stats(self) -> dict[str, float]:
+        with self.lock:
+            average = self.total_time / self.n_writes \
+                if self.n_writes > 0 else 0.0
+            return {
+                "writes": self.n_writes,
+                "coalesced": self.n_coalesced,
+                "average_ms": average * 1000,
+                "max_ms": self.max_time * 1000,
+            }
+
+
+def get_writer() -> ContentWriter:
+    return current_app.extensions["tekir_writer"]
+
+
+def write_source(fs_path: Path, text: str) -> None:
+    get_writer().write(fs_path, text)